@@ -3,61 +3,325 @@ traceattrs: Attribute change tracking decorator for Python classes.
 
 This module provides a class decorator, `traceattrs`, that automatically tracks all changes to instance attributes. 
 It supports regular classes, dataclasses, and classes with __slots__, and exposes attribute change history via dot notation.
+History is stored on each instance, so recording never touches state shared between instances or threads.
 """
 
-from collections import defaultdict
-from typing import Optional
+from collections import deque
+from dataclasses import fields, is_dataclass
+from functools import partial
+from types import FunctionType, MemberDescriptorType
+from typing import MutableSequence, Optional
+from weakref import WeakSet
 
 
-# Maps instance id to attribute history
-_instance_history: dict[int, dict[str, list[tuple[any, any]]]] = {}
+# Names of the instance attributes (or injected slots) holding the attribute history and its accessor
+_HISTORY_ATTR = '_traceattrs_history'
+_ACCESSOR_ATTR = 'history'
+
+# Names the decorator adds to every tracked class or instance
+_RESERVED_NAMES = (_ACCESSOR_ATTR, 'record_many')
+
+# Recorded history of one attribute: parallel old and new values, plus for bounded histories the number of
+# changes recorded since the last clear (unbounded histories keep every change, so their length is the count).
+# The value sequences are lists, or deques capped at max_history
+_AttributeHistory = tuple[MutableSequence[any], MutableSequence[any], Optional[list[int]]]
+
+# Attributes declared by the class but not assigned yet map to None, so they read like attributes without history
+_History = dict[str, Optional[_AttributeHistory]]
+
+# Shared by the accessors of all instances that have not recorded anything yet; never mutated
+_NO_HISTORY: _History = {}
 
 
 class HistoryAccessor:
     """Provides dot notation access to attribute history for an object."""
-    def __init__(self, history_data: dict[str, list[tuple[any, any]]]):
+    __slots__ = ('_history_data',)
+
+    def __init__(self, history_data: _History):
+        # The (old, new) pairs are built from the parallel value lists on read
         self._history_data = history_data
 
     def __getattr__(self, name: str) -> list[tuple[any, any]]:
-        return self._history_data.get(name, [])
+        # Special method lookups (e.g. __deepcopy__ by copy and pickle) must not resolve to an empty history
+        if name[:2] == name[-2:] == '__':
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> list[tuple[any, any]]:
+        entry = self._history_data.get(name)
+        if entry is None:
+            return ()
+        old_values, new_values, _ = entry
+        return list(zip(old_values, new_values))
+
+    def __len__(self) -> int:
+        return sum(self.get_count(name) for name in self._history_data)
 
     def __repr__(self) -> str:
-        return f"HistoryAccessor({dict(self._history_data)})"
+        return f"HistoryAccessor({self.get_all()})"
+
+    # Wrapped in a tuple so an empty history is still restored; pickle skips __setstate__ for falsy states
+    def __getstate__(self) -> tuple[_History]:
+        return (self._history_data,)
+
+    def __setstate__(self, state: tuple[_History]) -> None:
+        self._history_data, = state
 
     def get_all(self) -> dict[str, list[tuple[any, any]]]:
         """Return a copy of all attribute histories."""
-        return dict(self._history_data)
+        return {name: self[name] for name, entry in self._history_data.items() if entry is not None}
+
+    def get_count(self, attribute: str) -> int:
+        """Return the number of changes recorded for an attribute, including any discarded by max_history."""
+        entry = self._history_data.get(attribute)
+        if entry is None:
+            return 0
+        _, new_values, changes = entry
+        return len(new_values) if changes is None else changes[0]
 
     def clear(self, attribute: Optional[str] = None) -> None:
         """Clear history for a specific attribute or all attributes."""
         if attribute:
-            self._history_data[attribute].clear()
-        else:
+            entry = self._history_data.get(attribute)
+            if entry is not None:
+                old_values, new_values, changes = entry
+                old_values.clear()
+                new_values.clear()
+                if changes is not None:
+                    changes[0] = 0
+        elif self._history_data is not _NO_HISTORY:
             self._history_data.clear()
 
 
-def traceattrs(cls: type) -> type:
-    """Class decorator to track attribute changes on instances."""
+def _update_class_cells(obj: any, old_cls: type, new_cls: type) -> None:
+    """Point the __class__ cell of a function (used by zero-argument super()) at new_cls."""
+    if isinstance(obj, (classmethod, staticmethod)):
+        obj = obj.__func__
+    elif isinstance(obj, property):
+        for accessor in (obj.fget, obj.fset, obj.fdel):
+            _update_class_cells(accessor, old_cls, new_cls)
+        return
+    if not isinstance(obj, FunctionType) or '__class__' not in obj.__code__.co_freevars:
+        return
+    cell = obj.__closure__[obj.__code__.co_freevars.index('__class__')]
+    if cell.cell_contents is old_cls:
+        cell.cell_contents = new_cls
+
+
+def _add_history_slot(cls: type) -> type:
+    """Recreate a slotted class with extra slots for the attribute history and its accessor."""
+    slots = cls.__dict__.get('__slots__', ())
+    if isinstance(slots, str):
+        slots = (slots,)
+    cls_dict = {
+        name: value for name, value in cls.__dict__.items()
+        if name not in ('__dict__', '__weakref__')
+        and not (isinstance(value, MemberDescriptorType) and value.__objclass__ is cls)
+    }
+    cls_dict['__slots__'] = (*slots, _HISTORY_ATTR, _ACCESSOR_ATTR)
+    cls_dict['__qualname__'] = cls.__qualname__
+    new_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    for value in cls_dict.values():
+        _update_class_cells(value, cls, new_cls)
+    return new_cls
+
+
+def _restore_state(self, state: any) -> None:
+    """Restore copied or unpickled state without recording it as attribute changes."""
+    dict_state, slot_state = state if isinstance(state, tuple) else (state, None)
+    history = None
+    if dict_state:
+        history = dict_state.get(_HISTORY_ATTR)
+        self.__dict__.update(
+            (name, value) for name, value in dict_state.items() if name not in (_HISTORY_ATTR, _ACCESSOR_ATTR)
+        )
+    if slot_state:
+        history = slot_state.get(_HISTORY_ATTR, history)
+        for name, value in slot_state.items():
+            if name not in (_HISTORY_ATTR, _ACCESSOR_ATTR):
+                object.__setattr__(self, name, value)
+    # A shallow copy shares the history and accessor of the original, so the copy gets its own of both
+    if history is None:
+        history = _NO_HISTORY
+    else:
+        history = {
+            name: None if entry is None else (
+                entry[0].copy(), entry[1].copy(), None if entry[2] is None else entry[2].copy()
+            )
+            for name, entry in history.items()
+        }
+        object.__setattr__(self, _HISTORY_ATTR, history)
+    object.__setattr__(self, _ACCESSOR_ATTR, HistoryAccessor(history))
+
+
+def _declared_attributes(cls: type) -> tuple[str, ...]:
+    """Return the attribute names declared by cls and its bases through __slots__ or dataclass fields."""
+    names = [field.name for field in fields(cls)] if is_dataclass(cls) else []
+    for klass in reversed(cls.__mro__):
+        if '__slots__' in vars(klass):
+            names += [name for name, value in vars(klass).items() if isinstance(value, MemberDescriptorType)]
+    return tuple(name for name in dict.fromkeys(names) if name not in (_HISTORY_ATTR, _ACCESSOR_ATTR))
+
+
+def _managed_attributes(cls: type) -> frozenset[str]:
+    """Return the names of data descriptors other than slots (e.g. properties) defined by cls and its bases."""
+    return frozenset(
+        name for klass in cls.__mro__ for name, value in vars(klass).items()
+        if hasattr(type(value), '__set__') and not isinstance(value, MemberDescriptorType)
+        and not name[:2] == name[-2:] == '__'
+    )
+
+
+def _record_lines(dedupe: bool, counted: bool, trust_history: bool) -> list[str]:
+    """Return source lines that perform the assignment of value to name on self and record it once it succeeded."""
+    # Unpacking the None placeholder of a declared attribute raises TypeError, like a missing one raises KeyError
+    lines = [
+        "try:",
+        "    old_values, new_values, changes = history[name]",
+        "except (KeyError, TypeError):",
+        "    old_values, new_values, changes = history[name] = _new_attribute_history()",
+    ]
+    # With a plain object.__setattr__ the last recorded new value is the current one, so the attribute is only
+    # looked up on first write; a custom __setattr__ or a property setter may reject or transform the value, and
+    # a deleted attribute no longer holds it
+    if trust_history:
+        lines.append(
+            "old_value = new_values[-1] if new_values and name not in _volatile_attributes"
+            " else getattr(self, name, None)"
+        )
+    else:
+        lines.append("old_value = getattr(self, name, None)")
+    lines.append("_original_setattr(self, name, value)")
+    record = [
+        "old_values.append(old_value)",
+        "new_values.append(value)",
+        *(["changes[0] += 1"] if counted else []),
+    ]
+    if dedupe:
+        # The value is already assigned, so values that cannot be compared (e.g. array-likes) count as changed
+        lines += [
+            "try:",
+            "    changed = not new_values or (old_value is not value and old_value != value)",
+            "except Exception:",
+            "    changed = True",
+            "if changed:",
+            *(f"    {line}" for line in record),
+        ]
+    else:
+        lines += record
+    return lines
+
+
+def _create_fn(cls: type, name: str, args: str, body: list[str], globals: dict, doc: str) -> FunctionType:
+    """Compile a method of cls from its source lines."""
+    source = f"def {name}({args}):\n" + "".join(f"    {line}\n" for line in body)
+    namespace = {}
+    exec(source, globals, namespace)
+    fn = namespace[name]
+    fn.__qualname__ = f"{cls.__qualname__}.{name}"
+    fn.__module__ = cls.__module__
+    fn.__doc__ = doc
+    return fn
+
+
+def traceattrs(cls: Optional[type] = None, *, max_history: Optional[int] = None, dedupe: bool = False):
+    """Class decorator to track attribute changes on instances.
+
+    Use as ``@traceattrs`` or with options, e.g. ``@traceattrs(max_history=n)`` to keep only the last n changes
+    per attribute, or ``@traceattrs(dedupe=True)`` to skip writes that do not change the recorded value.
+    """
+    if max_history is not None and max_history < 1:
+        raise ValueError("max_history must be a positive integer")
+    if cls is None:
+        return partial(traceattrs, max_history=max_history, dedupe=dedupe)
+
+    declared = set(vars(cls)) | ({field.name for field in fields(cls)} if is_dataclass(cls) else set())
+    conflicts = [name for name in _RESERVED_NAMES if name in declared]
+    if conflicts:
+        raise TypeError(f"{cls.__qualname__} defines {', '.join(conflicts)}, which traceattrs reserves")
+
+    # Bounded histories evict their oldest entry in O(1) on append
+    history_factory = list if max_history is None else partial(deque, maxlen=max_history)
+
+    # Instances without a __dict__ need a slot to keep their history on
+    if not cls.__dictoffset__ and not hasattr(cls, _HISTORY_ATTR):
+        cls = _add_history_slot(cls)
+
     original_setattr = getattr(cls, '__setattr__', object.__setattr__)
-    original_init = getattr(cls, '__init__', lambda self: None)
-
-    def custom_init(self, *args, **kwargs):
-        # Initialize history for this instance
-        _instance_history[id(self)] = defaultdict(list)
-        original_init(self, *args, **kwargs)
-
-    def custom_setattr(self, name: str, value: any) -> None:
-        """Intercepts attribute assignment to record old and new values in the instance's history."""
-        obj_id = id(self)
-        old_value = getattr(self, name, None)
-        _instance_history[obj_id][name].append((old_value, value))
-        original_setattr(self, name, value)
-
-    def get_history(self) -> HistoryAccessor:
-        """Returns a HistoryAccessor for accessing this instance's attribute change history."""
-        return HistoryAccessor(_instance_history[id(self)])
-
-    cls.__init__ = custom_init
-    cls.__setattr__ = custom_setattr
-    cls.history = property(get_history)
+    original_delattr = getattr(cls, '__delattr__', object.__delattr__)
+    trust_history = original_setattr is object.__setattr__
+    # Attributes whose last recorded value may not be their current one; subclasses add their own properties
+    # on first instantiation and deletions add the deleted name
+    volatile_attributes = set(_managed_attributes(cls))
+    checked_subclasses = WeakSet()
+    original_new = cls.__new__
+    # Attributes known up front get a placeholder key in every history dict; copying this template gives each
+    # new history dict its final size at once instead of growing it key by key
+    history_template = dict.fromkeys(_declared_attributes(cls))
+
+    def custom_new(klass, *args, **kwargs):
+        # object.__new__ rejects the constructor arguments, which are meant for __init__; without an __init__
+        # to take them they are passed on, so they are still rejected
+        if original_new is object.__new__ and klass.__init__ is not object.__init__:
+            self = original_new(klass)
+        else:
+            self = original_new(klass, *args, **kwargs)
+        if klass is not cls and klass not in checked_subclasses:
+            volatile_attributes.update(_managed_attributes(klass))
+            checked_subclasses.add(klass)
+        # A plain instance attribute rather than a property, so reading obj.history runs no Python code
+        object.__setattr__(self, _ACCESSOR_ATTR, HistoryAccessor(_NO_HISTORY))
+        return self
+
+    def custom_delattr(self, name):
+        original_delattr(self, name)
+        volatile_attributes.add(name)
+
+    def new_attribute_history() -> _AttributeHistory:
+        return history_factory(), history_factory(), None if max_history is None else [0]
+
+    def new_history(self) -> _History:
+        # Initialize history on the first recorded assignment; it is freed together with the instance
+        history = history_template.copy()
+        object.__setattr__(self, _HISTORY_ATTR, history)
+        self.history._history_data = history
+        return history
+
+    fn_globals = {
+        '_original_setattr': original_setattr,
+        '_new_attribute_history': new_attribute_history,
+        '_new_history': new_history,
+        '_volatile_attributes': volatile_attributes,
+        '_getattribute': object.__getattribute__,
+    }
+    # Looked up through object.__getattribute__ so a user-defined __getattr__ cannot answer for a missing history
+    get_history = [
+        "try:",
+        "    history = _getattribute(self, '_traceattrs_history')",
+        "except AttributeError:",
+        "    history = _new_history(self)",
+    ]
+    record = _record_lines(
+        dedupe,
+        counted=max_history is not None,
+        trust_history=trust_history,
+    )
+    cls.__new__ = staticmethod(custom_new)
+    if trust_history:
+        cls.__delattr__ = custom_delattr
+    # copy and pickle restore slots with setattr(), which would record the restored state as new changes
+    if not hasattr(cls, '__setstate__'):
+        cls.__setstate__ = _restore_state
+    cls.__setattr__ = _create_fn(
+        cls, '__setattr__', 'self, name, value',
+        [*get_history, *record],
+        fn_globals,
+        "Intercepts attribute assignment to record old and new values in the instance's history.",
+    )
+    cls.record_many = _create_fn(
+        cls, 'record_many', 'self, updates',
+        [*get_history, "for name, value in updates:", *(f"    {line}" for line in record)],
+        fn_globals,
+        "Assign and record a batch of (name, value) pairs in order, in a single call.",
+    )
     return cls
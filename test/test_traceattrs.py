@@ -3,6 +3,13 @@ Unit tests for the traceattrs attribute tracking library.
 Covers regular classes, dataclasses, slotted classes, inheritance, and history management.
 """
 
+import copy
+import gc
+import inspect
+import pickle
+import threading
+import weakref
+
 import pytest
 from dataclasses import dataclass
 
@@ -84,6 +91,8 @@ def test_regular_class():
     assert obj.history.__priv == [(None, 50), (50, 200)], "Private attribute '__priv' tracking"
     assert obj.history.val == [(None, 50), (50, 50)], "Same value attribute 'val' tracking"
     assert obj.history.s == [(None, "Hello"), ("Hello", "HelloWorld")], "Non integer attribute 's' tracking"
+    assert obj.history["x"] == obj.history.x, "Subscript access matches dot notation"
+    assert obj.history.missing == () and obj.history["missing"] == (), "Untracked attribute has empty history"
 
 
 def test_dataclass_tracking():
@@ -160,6 +169,9 @@ def test_history():
     }, "clear('x') on obj1 does not affect obj2"
     obj1.history.clear()
     assert obj1.history.get_all() == {}, "clear() clears all history"
+    assert obj1.history is obj1.history, "history accessor is reused across accesses"
+    assert obj1.history is not obj2.history, "each object has its own history accessor"
+    assert not hasattr(obj1.history, '__dict__'), "history accessor has no per-instance __dict__"
     assert obj2.history.get_all() == {
         'x': [(None, 2), (2, 100)],
         'y': [(None, 2), (2, 300)]
@@ -178,3 +190,287 @@ def test_sequential_object_history():
     assert obj2.history.x == [(None, 30), (30, 200)], "obj2 x history tracked correctly"
     assert obj1.history.y == [(None, 20), (20, 300)], "obj1 y history tracked correctly"
     assert obj2.history.y == [(None, 40), (40, 400)], "obj2 y history tracked correctly"
+
+
+def test_history_released_with_instance():
+    """Ensure that recorded values are released once the tracked object is garbage collected."""
+    class Value:
+        pass
+
+    for cls in (RegularClass, ManualSlots):
+        value = Value()
+        value_ref = weakref.ref(value)
+        obj = cls(value, 2)
+        del value, obj
+        gc.collect()
+        assert value_ref() is None, f"{cls.__name__} history released with the instance"
+
+
+def test_max_history():
+    """Ensure that max_history keeps only the most recent changes per attribute."""
+    @traceattrs(max_history=2)
+    class Bounded:
+        def __init__(self, x):
+            self.x = x
+
+    obj = Bounded(1)
+    obj.x = 2
+    obj.x = 3
+    obj.y = 10
+    assert list(obj.history.x) == [(1, 2), (2, 3)], "Oldest change evicted once max_history is reached"
+    assert list(obj.history.y) == [(None, 10)], "Attributes are bounded independently"
+    obj.history.clear('x')
+    obj.x = 4
+    assert list(obj.history.x) == [(3, 4)], "Recording resumes from the current value after clear"
+    with pytest.raises(ValueError):
+        traceattrs(max_history=0)
+
+
+def test_dedupe():
+    """Ensure that dedupe skips assignments that do not change the attribute value."""
+    @traceattrs(dedupe=True)
+    class Deduped:
+        def __init__(self, x):
+            self.x = x
+
+    obj = Deduped(1)
+    obj.x = 1
+    obj.x = 2
+    obj.x = 2
+    obj.s = "Hello"
+    obj.s = "Hello"
+    assert obj.history.x == [(None, 1), (1, 2)], "Repeated values are not recorded"
+    assert obj.history.s == [(None, "Hello")], "Equal non integer values are not recorded"
+    assert obj.x == 2, "Assignment still happens when the change is not recorded"
+
+    class Incomparable:
+        def __eq__(self, other):
+            raise TypeError("ambiguous comparison")
+
+    values = [Incomparable(), Incomparable()]
+    obj.x = values[0]
+    obj.x = values[1]
+    assert obj.history.x[-2:] == [(2, values[0]), (values[0], values[1])], "Values that fail to compare are recorded"
+
+
+def test_declared_attributes():
+    """Ensure that attributes declared through __slots__ have no history until they are assigned."""
+    @traceattrs
+    class PartiallySet:
+        __slots__ = ['x', 'y']
+        def __init__(self, x):
+            self.x = x
+
+    obj = PartiallySet(1)
+    assert obj.history.get_all() == {'x': [(None, 1)]}, "Declared but unset attribute is not listed"
+    assert obj.history.y == () and obj.history.get_count('y') == 0, "Declared but unset attribute has empty history"
+    obj.history.clear('y')
+    obj.history.clear('z')
+    assert obj.history.get_all() == {'x': [(None, 1)]}, "Clearing an unset or untracked attribute is a no-op"
+    assert repr(obj.history) == "HistoryAccessor({'x': [(None, 1)]})", "repr() lists only assigned attributes"
+    obj.y = 2
+    assert obj.history.get_all() == {'x': [(None, 1)], 'y': [(None, 2)]}, "Declared attribute is listed once assigned"
+
+
+def test_subclass_init_without_super():
+    """Ensure that subclasses overriding __init__ without calling super() are still tracked."""
+    class Child(RegularClass):
+        def __init__(self, x):
+            self.x = x
+
+    obj = Child(1)
+    obj.x = 2
+    assert obj.history.x == [(None, 1), (1, 2)], "Subclass attribute 'x' tracking"
+    assert str(inspect.signature(RegularClass.__init__)) == "(self, x, y)", "__init__ is left untouched"
+
+
+def test_generated_method_names():
+    """Ensure that the generated methods carry the module and qualified name of the decorated class."""
+    for method in (RegularClass.__setattr__, RegularClass.record_many):
+        assert method.__module__ == RegularClass.__module__, "Generated methods belong to the class module"
+        assert method.__qualname__.startswith("RegularClass."), "Generated methods are named after the class"
+
+
+def test_record_many():
+    """Test that record_many assigns and records a batch of attributes like individual assignments."""
+    obj = RegularClass(1, 2)
+    obj.record_many([('x', 10), ('z', 5), ('x', 20)])
+    assert (obj.x, obj.z) == (20, 5), "record_many assigns the attributes"
+    assert obj.history.x == [(None, 1), (1, 10), (10, 20)], "record_many records 'x' in order"
+    assert obj.history.z == [(None, 5)], "record_many records new attribute 'z'"
+
+    slotted = ManualSlots(1, 2)
+    with pytest.raises(AttributeError):
+        slotted.record_many([('x', 3), ('z', 4)])
+    assert slotted.history.x == [(None, 1), (1, 3)], "Pairs before a failing assignment are applied"
+
+
+def test_copy_and_pickle():
+    """Ensure that copied and unpickled objects keep an independent copy of the history."""
+    for obj in (RegularClass(1, 2), ManualSlots(1, 2), SlottedDataClass(1, 2)):
+        obj.x = 10
+        expected = obj.history.get_all()
+        clones = [copy.deepcopy(obj), pickle.loads(pickle.dumps(obj))]
+        if hasattr(obj, '__dict__'):
+            # Protocols 0 and 1 cannot pickle slotted objects without a custom __getstate__
+            clones.append(pickle.loads(pickle.dumps(obj, 0)))
+        for clone in clones:
+            assert clone.history.get_all() == expected, "Clone has the original history and nothing else"
+            clone.x = 20
+            assert clone.history.x == expected['x'] + [(10, 20)], "Clone continues the original history"
+            assert obj.history.get_all() == expected, "Original history is unaffected by the clone"
+        shallow = copy.copy(obj)
+        assert (shallow.x, shallow.y) == (obj.x, obj.y), "Shallow copy restores the attributes"
+        assert shallow.history.get_all() == expected, "Shallow copy restores the history without recording"
+        assert shallow.history is not obj.history, "Shallow copy has its own history accessor"
+        shallow.x = 99
+        assert obj.history.get_all() == expected, "Original history is unaffected by the shallow copy"
+        assert shallow.history.x == expected['x'] + [(10, 99)], "Shallow copy continues its own history"
+
+
+def test_history_before_first_assignment():
+    """Ensure that objects without any recorded assignment have an empty, independent history."""
+    @traceattrs
+    class Empty:
+        pass
+
+    obj1 = Empty()
+    obj2 = Empty()
+    assert obj1.history.get_all() == {} and obj1.history.x == (), "No history before the first assignment"
+    obj1.history.clear()
+    obj1.x = 1
+    assert obj1.history.x == [(None, 1)], "History is created on the first assignment"
+    assert obj2.history.get_all() == {}, "Other objects are unaffected"
+    assert not hasattr(obj2, '_traceattrs_history'), "History is not allocated until needed"
+    with pytest.raises(TypeError):
+        Empty(1, 2)
+
+
+def test_threads_on_separate_objects():
+    """Ensure that objects written from different threads keep complete, independent histories."""
+    objects = [RegularClass(0, 0) for _ in range(8)]
+
+    def write(obj):
+        for value in range(1, 1001):
+            obj.x = value
+
+    threads = [threading.Thread(target=write, args=(obj,)) for obj in objects]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for obj in objects:
+        assert obj.history.x == [(None, 0)] + [(value - 1, value) for value in range(1, 1001)], "Complete history per object"
+
+
+def test_get_count():
+    """Test get_count() and len() of the history, including changes discarded by max_history."""
+    @traceattrs(max_history=2)
+    class Bounded:
+        def __init__(self, x):
+            self.x = x
+
+    obj = Bounded(1)
+    obj.x = 2
+    obj.x = 3
+    obj.y = 10
+    assert obj.history.get_count('x') == 3, "get_count() includes changes discarded by max_history"
+    assert obj.history.get_count('z') == 0, "get_count() of an untracked attribute"
+    assert len(obj.history) == 4, "len() counts changes across all attributes"
+    obj.history.clear('x')
+    assert obj.history.get_count('x') == 0 and len(obj.history) == 1, "clear('x') resets the count of 'x'"
+    obj.history.clear()
+    assert len(obj.history) == 0, "clear() resets all counts"
+    obj = RegularClass(1, 2)
+    obj.x = 3
+    assert obj.history.get_count('x') == 2 and len(obj.history) == 3, "get_count() and len() without max_history"
+    obj.count = 1
+    assert obj.history.count == [(None, 1)], "An attribute named count keeps its dot notation history"
+
+
+def test_rejected_and_normalized_assignments():
+    """Ensure that only values the object actually held are recorded."""
+    @traceattrs
+    class Validated:
+        def __init__(self, x):
+            self.x = x
+
+        def __setattr__(self, name, value):
+            if value == -1:
+                raise ValueError("negative")
+            object.__setattr__(self, name, value)
+
+    @traceattrs
+    class Clamped:
+        def __init__(self, x):
+            self.x = x
+
+        @property
+        def x(self):
+            return self._x
+
+        @x.setter
+        def x(self, value):
+            self._x = min(value, 10)
+
+    obj = Validated(1)
+    with pytest.raises(ValueError):
+        obj.x = -1
+    obj.x = 5
+    assert obj.history.x == [(None, 1), (1, 5)], "Rejected assignment is not recorded"
+
+    slotted = ManualSlots(1, 2)
+    with pytest.raises(AttributeError):
+        slotted.z = 3
+    assert slotted.history.z == [], "Failed assignment to an undeclared slot is not recorded"
+
+    clamped = Clamped(50)
+    clamped.x = 5
+    assert clamped.history.x == [(None, 50), (10, 5)], "Old value is the value the property actually stored"
+
+    class ClampedChild(RegularClass):
+        @property
+        def x(self):
+            return self._x
+
+        @x.setter
+        def x(self, value):
+            self._x = min(value, 10)
+
+    child = ClampedChild(50, 1)
+    child.x = 5
+    assert child.history.x == [(None, 50), (10, 5)], "Properties added by subclasses are read from the object"
+
+    deleted = RegularClass(1, 2)
+    del deleted.x
+    deleted.x = 5
+    assert deleted.history.x == [(None, 1), (None, 5)], "Old value of a deleted attribute is None"
+
+
+def test_reserved_names():
+    """Ensure that classes defining the names traceattrs adds are rejected instead of silently overwritten."""
+    class WithRecordMany:
+        def record_many(self, updates):
+            pass
+
+    @dataclass
+    class WithHistoryField:
+        history: list
+
+    for cls in (WithRecordMany, WithHistoryField):
+        with pytest.raises(TypeError):
+            traceattrs(cls)
+
+
+def test_class_with_getattr():
+    """Ensure that a user-defined __getattr__ does not stand in for the history before the first assignment."""
+    @traceattrs
+    class Fallback:
+        def __getattr__(self, name):
+            return None
+
+    obj = Fallback()
+    obj.x = 1
+    obj.x = 2
+    assert obj.history.x == [(None, 1), (1, 2)]
+    assert obj.missing is None